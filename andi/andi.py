@@ -1,16 +1,16 @@
-from collections import OrderedDict, defaultdict
-from dataclasses import dataclass
+from __future__ import annotations
+
+from dataclasses import dataclass, field
 from typing import (
     Dict, List, Optional, Type, Callable, Union, Container,
-    Tuple, MutableMapping, Any, Mapping)
+    Tuple, Any, Mapping, Set, Generator, get_args)
 
 from andi.typeutils import (
-    get_union_args,
-    is_union,
     get_globalns,
     get_unannotated_params,
     get_callable_func_obj,
     get_type_hints_with_extras,
+    is_union,
     strip_annotated,
 )
 from andi.errors import (
@@ -21,6 +21,9 @@ from andi.errors import (
 )
 
 
+ArgumentTypes = Dict[str, Tuple[Optional[Type], ...]]
+
+
 def inspect(class_or_func: Callable) -> Dict[str, List[Optional[Type]]]:
     """
     For each argument of the ``class_or_func`` return a list of possible types.
@@ -34,7 +37,20 @@ def inspect(class_or_func: Callable) -> Dict[str, List[Optional[Type]]]:
     * a callable object - in this case ``obj.__call__`` annotations
       are returned
     """
+    return {name: list(types)
+            for name, types in _inspect(class_or_func).items()}
+
+
+def _inspect(class_or_func: Callable) -> ArgumentTypes:
+    """ Like ``inspect``, but possible types are returned as tuples
+    instead of lists. """
     func = get_callable_func_obj(class_or_func)
+    if func is object.__init__:
+        return {}  # class without __init__, quite common for leaf dependencies
+    return _inspect_func(func)
+
+
+def _inspect_func(func: Callable) -> ArgumentTypes:
     globalns = get_globalns(func)
     annotations = get_type_hints_with_extras(func, globalns)
     for name in get_unannotated_params(func, annotations):
@@ -42,15 +58,19 @@ def inspect(class_or_func: Callable) -> Dict[str, List[Optional[Type]]]:
     annotations.pop('return', None)
     annotations.pop('self', None)  # FIXME: pop first argument of methods
     annotations.pop('cls', None)
-    res = {}
-    for key, tp in annotations.items():
-        if is_union(tp):
-            res[key] = get_union_args(tp)
-        elif tp is None:
-            res[key] = []
-        else:
-            res[key] = [tp]
-    return res
+    return {key: _possible_types(tp) for key, tp in annotations.items()}
+
+
+def _possible_types(tp) -> Tuple[Optional[Type], ...]:
+    """ Return the types an argument annotated with ``tp`` can take.
+    ``tp`` is None for non annotated arguments. """
+    if tp is None:
+        return ()
+    if type(tp) is type:  # plain classes, by far the most common case
+        return (tp,)
+    if is_union(tp):
+        return get_args(tp)
+    return (tp,)
 
 
 ContainerOrCallableType = Union[
@@ -64,6 +84,7 @@ class KwargsSpec(Dict[str, Callable]):
     kwargs specification. Dict with the name of the argument
     and the callable that is required to build an instance for such argument.
     """
+    __slots__ = ()
 
     def kwargs(self, instances: Mapping[Callable, Any]) -> Dict[str, Any]:
         """
@@ -97,6 +118,7 @@ class Plan(List[Step]):
     to invoke the class/function. In other words, returned dict is not a
     incomplete set of ``kwargs``.
     """
+    __slots__ = ('full_final_kwargs',)
 
     def __init__(self, *args, full_final_kwargs: bool = False, **kwargs):
         self.full_final_kwargs = full_final_kwargs
@@ -138,9 +160,9 @@ def plan(class_or_func: Callable, *,
          is_injectable: ContainerOrCallableType,
          externally_provided: Optional[ContainerOrCallableType] = None,
          full_final_kwargs=False,
-         overrides: Optional[OverrideFn] = None,
+         overrides: Optional[Union[OverrideFn, Mapping[Callable, Callable]]] = None,
          recursive_overrides: bool = False,
-         custom_builder_fn: Callable[[Callable], Optional[Callable]] = lambda _: None
+         custom_builder_fn: Optional[Callable[[Callable], Optional[Callable]]] = None
          ) -> Plan:
     """ Plan the sequence of instantiation steps required to fulfill the
     the arguments of the given function or the arguments of its
@@ -282,6 +304,8 @@ def plan(class_or_func: Callable, *,
         ``PenneWithTomate`` by ``SpaghettiBolognese`` whenever it is find in the
         dependendy tree, but updating the plan so that ``SpaghettiBolognese``
         gets its dependencies ``Meat`` and ``Spaghetti`` resolved properly.
+        A mapping from classes/functions to their replacements can
+        also be given, e.g. ``{PenneWithTomate: SpaghettiBolognese}``.
     :param recursive_overrides: If True, ``overrides`` are applied recursively
         to the children dependencies of an overriden class/function.
         If False, overrides are not applied to the children of an
@@ -303,21 +327,30 @@ def plan(class_or_func: Callable, *,
         constructor) and None otherwise.
     :return: A plan
     """
+    custom_builder_fn = custom_builder_fn or _empty_custom_builder
     is_injectable = _ensure_can_provide_func(is_injectable)
     externally_provided = _ensure_can_provide_func(externally_provided)
-    overrides = overrides or _empty_overrides
+    if not overrides:
+        overrides = _empty_overrides
+    elif isinstance(overrides, Mapping):
+        overrides = overrides.get
     class_or_func, overrides = _may_override(class_or_func, overrides, recursive_overrides)
-
-    plan, _ = _plan(class_or_func,
-                    is_injectable=is_injectable,
-                    externally_provided=externally_provided,
-                    full_final_kwargs=full_final_kwargs,
-                    dependency_stack=None,
-                    overrides=overrides,
-                    recursive_overrides=recursive_overrides,
-                    custom_builder_fn=custom_builder_fn,
-                    )
-    return plan
+    # Subtrees can only be reused when all nodes are planned
+    # with the same overrides
+    uniform_overrides = recursive_overrides or overrides is _empty_overrides
+
+    context = _PlanContext(
+        is_injectable=is_injectable,
+        externally_provided=externally_provided,
+        is_selectable=_selectable_func(
+            is_injectable, externally_provided, custom_builder_fn),
+        recursive_overrides=recursive_overrides,
+        custom_builder_fn=custom_builder_fn,
+        memo={} if uniform_overrides else None,
+    )
+    return _plan(class_or_func, context,
+                 full_final_kwargs=full_final_kwargs,
+                 overrides=overrides)
 
 
 @dataclass(frozen=True)
@@ -326,80 +359,164 @@ class CustomBuilder:
     factory: Callable
 
 
-def _plan(class_or_func: Callable, *,
-          is_injectable: Callable[[Callable], bool],
-          externally_provided: Callable[[Callable], bool],
-          full_final_kwargs,
-          dependency_stack=None,
-          overrides: Callable[[Callable], Optional[Callable]],
-          recursive_overrides: bool = False,
-          custom_builder_fn: Callable[[Callable], Optional[Callable]] = lambda _: None,
-          custom_builder_result: Optional[Callable] = None
-          ) -> Tuple[Plan, List[Tuple]]:
-    dependency_stack = dependency_stack or []
+PlanKey = Union[Callable, CustomBuilder]
+# Plan steps as a dict, as used while planning
+_Steps = Dict[PlanKey, KwargsSpec]
+
+
+@dataclass
+class _PlanContext:
+    """
+    State shared by all the nodes planned in a single ``plan`` call.
+
+    ``dependency_stack`` and ``dependency_set`` are the path from the root
+    to the node being planned: each node adds itself to them before
+    planning its dependencies and removes itself afterwards.
+
+    ``memo`` stores the steps of the dependencies already planned
+    successfully, so that a dependency shared by several nodes of the
+    tree is planned only once. It is None when subplans can't be reused.
+
+    ``selections`` caches the ``_select_type`` result for each pair of
+    possible types and overrides function.
+
+    ``inspected`` caches the ``_inspect`` results, so that annotations
+    are resolved only once per plan. It is not kept across calls, which
+    would keep alive the inspected classes and functions.
+    """
+    is_injectable: Callable[[Callable], bool]
+    externally_provided: Callable[[Callable], bool]
+    is_selectable: Callable[[Callable], bool]
+    recursive_overrides: bool
+    custom_builder_fn: Callable[[Callable], Optional[Callable]]
+    memo: Optional[Dict[PlanKey, _Steps]]
+    dependency_stack: List[PlanKey] = field(default_factory=list)
+    dependency_set: Set[PlanKey] = field(default_factory=set)
+    selections: Dict[Tuple, Tuple[Optional[Callable], OverrideFn]] = field(
+        default_factory=dict)
+    inspected: Dict[Callable, ArgumentTypes] = field(default_factory=dict)
+
+
+# Result of planning a node: the steps, the errors found and
+# whether all the node arguments could be provided
+_PlanResult = Tuple[_Steps, List[Tuple], bool]
+# Dependency to plan: (class_or_func, overrides, custom_builder_result)
+_PlanRequest = Tuple[Callable, OverrideFn, Optional[Callable]]
+
+
+def _plan(class_or_func: Callable, context: _PlanContext, *,
+          full_final_kwargs: bool,
+          overrides: OverrideFn,
+          ) -> Plan:
+    """
+    Plan ``class_or_func`` and, transitively, all its dependencies.
+
+    Every node is planned by a ``_plan_node`` generator, which yields
+    the dependencies it needs planned and receives their results back.
+    The generators are run here using an explicit stack, so deep
+    dependency trees don't hit the recursion limit. The ``Plan`` is
+    only built for the root node.
+    """
+    stack = [_plan_node(class_or_func, context,
+                        full_final_kwargs=full_final_kwargs,
+                        overrides=overrides)]
+    result = None  # type: Optional[_PlanResult]
+    while True:
+        try:
+            request = stack[-1].send(result)
+        except StopIteration as e:
+            stack.pop()
+            if not stack:
+                steps, _, full = e.value
+                return Plan(steps.items(), full_final_kwargs=full)
+            result = e.value
+        else:
+            dependency, dependency_overrides, custom_builder_result = request
+            stack.append(_plan_node(
+                dependency, context,
+                full_final_kwargs=True,
+                overrides=dependency_overrides,
+                custom_builder_result=custom_builder_result,
+            ))
+            result = None
+
+
+def _plan_node(class_or_func: Callable, context: _PlanContext, *,
+               full_final_kwargs: bool,
+               overrides: OverrideFn,
+               custom_builder_result: Optional[Callable] = None,
+               ) -> Generator[_PlanRequest, Optional[_PlanResult], _PlanResult]:
+    dependency_stack = context.dependency_stack
+    dependency_set = context.dependency_set
+    memo = context.memo
     is_root_call = not dependency_stack  # For better code reading
-    plan_od = OrderedDict()  # type: MutableMapping[Union[Callable, CustomBuilder], KwargsSpec]
+    plan_od = {}  # type: _Steps
     type_for_arg = KwargsSpec()
 
-    if externally_provided(strip_annotated(class_or_func)):
-        return Plan([(class_or_func, KwargsSpec())], full_final_kwargs=True), []
+    if (context.externally_provided is not _never
+            and context.externally_provided(strip_annotated(class_or_func))):
+        return {class_or_func: KwargsSpec()}, [], True
 
     if not custom_builder_result:
-        plan_key = class_or_func  # type: Union[Callable, CustomBuilder]
+        plan_key = class_or_func  # type: PlanKey
     else:
         plan_key = CustomBuilder(custom_builder_result, class_or_func)
 
     # At this point the class/function must be injectable or built by a custom builder for non root cases
-    assert is_root_call or custom_builder_result or is_injectable(strip_annotated(class_or_func))
-
-    if class_or_func in dependency_stack:
-        return Plan(), [CyclicDependencyErrCase(class_or_func, dependency_stack)]
-
-    dependency_stack = dependency_stack + [plan_key]
-    arguments = inspect(class_or_func)
-
-    args_errs = defaultdict(list)  # type: Dict[str, List[Tuple]]
-    non_injectable_errs = defaultdict(list)  # type: Dict[str, List[Tuple]]
+    assert (is_root_call or custom_builder_result
+            or context.is_injectable(strip_annotated(class_or_func)))
+
+    # A custom builder is tracked by its plan key, which must be checked
+    # too, or a builder requiring the type it builds would loop forever
+    if class_or_func in dependency_set or plan_key in dependency_set:
+        return {}, [CyclicDependencyErrCase(class_or_func,
+                                            list(dependency_stack))], False
+
+    if memo is not None and plan_key in memo:
+        return memo[plan_key], [], True
+
+    dependency_stack.append(plan_key)
+    dependency_set.add(plan_key)
+    arguments = _cached_inspect(class_or_func, context)
+
+    # Plain dicts are cheaper to create than defaultdicts, and most
+    # nodes have no errors at all
+    args_errs = {}  # type: Dict[str, List[Tuple]]
+    non_injectable_errs = {}  # type: Dict[str, List[Tuple]]
     for argname, types in arguments.items():
-        sel_cls, arg_overrides = _select_type(
-            types, is_injectable, externally_provided, overrides, recursive_overrides,
-            custom_builder_fn
-        )
+        sel_cls, arg_overrides = _cached_select_type(types, overrides, context)
         if sel_cls is not None:
             errors = []  # type: List[Tuple]
             if sel_cls not in plan_od:
                 run_plan = True
-                custom_builder = custom_builder_fn(sel_cls)
+                custom_builder = (None
+                                  if context.custom_builder_fn is _empty_custom_builder
+                                  else context.custom_builder_fn(sel_cls))
                 if custom_builder:
-                    custom_builder_args = inspect(custom_builder)
+                    custom_builder_args = _cached_inspect(custom_builder, context)
                     for arg_types in custom_builder_args.values():
                         if class_or_func in arg_types:
                             # Break the cycle by ignoring the custom builder.
                             # This allows building an object externally and then using it to build
                             # another object of the same type, via a custom builder.
-                            if not externally_provided(sel_cls):
-                                non_injectable_errs[argname].append(
+                            if not context.externally_provided(sel_cls):
+                                non_injectable_errs.setdefault(argname, []).append(
                                     NonInjectableOrExternalErrCase(
-                                        argname, class_or_func, types
+                                        argname, class_or_func, list(types)
                                     )
                                 )
                                 run_plan = False
                             custom_builder = None
                             break
                 if run_plan:
-                    plan, errors = _plan(custom_builder or sel_cls,
-                                         is_injectable=is_injectable,
-                                         externally_provided=externally_provided,
-                                         full_final_kwargs=True,
-                                         dependency_stack=dependency_stack,
-                                         overrides=arg_overrides,
-                                         recursive_overrides=recursive_overrides,
-                                         custom_builder_fn=custom_builder_fn,
-                                         custom_builder_result=sel_cls if custom_builder else None,
-                                         )
-                    plan_od.update(plan)
+                    result = yield (custom_builder or sel_cls,
+                                    arg_overrides,
+                                    sel_cls if custom_builder else None)
+                    assert result is not None
+                    steps, errors, _ = result
+                    plan_od.update(steps)
             if errors:
-                args_errs[argname].extend(errors)
+                args_errs.setdefault(argname, []).extend(errors)
             else:
                 type_for_arg[argname] = sel_cls
         else:
@@ -407,8 +524,11 @@ def _plan(class_or_func: Callable, *,
                 err_case = LackingAnnotationErrCase(argname, class_or_func)  # type: Tuple
             else:
                 err_case = NonInjectableOrExternalErrCase(argname, class_or_func,
-                                                          types)
-            non_injectable_errs[argname].append(err_case)
+                                                          list(types))
+            non_injectable_errs.setdefault(argname, []).append(err_case)
+
+    dependency_stack.pop()
+    dependency_set.discard(plan_key)
 
     # Error managing
     if full_final_kwargs:
@@ -419,19 +539,47 @@ def _plan(class_or_func: Callable, *,
     # Plan filling
     if not args_errs:
         plan_od[plan_key] = type_for_arg
-    plan = Plan(plan_od.items(), full_final_kwargs=not non_injectable_errs)
+    if memo is not None and not is_root_call and not args_errs:
+        memo[plan_key] = plan_od
     flatten_errors = [error
                       for errors in args_errs.values()
                       for error in errors]
-    return plan, flatten_errors
+    return plan_od, flatten_errors, not non_injectable_errs
+
+
+def _cached_inspect(class_or_func: Callable, context: _PlanContext
+                    ) -> ArgumentTypes:
+    """ ``_inspect`` cached for the duration of a ``plan`` call """
+    try:
+        return context.inspected[class_or_func]
+    except KeyError:
+        pass
+    except TypeError:  # not hashable, so not cacheable
+        return _inspect(class_or_func)
+    result = context.inspected[class_or_func] = _inspect(class_or_func)
+    return result
+
+
+def _cached_select_type(types, overrides: OverrideFn, context: _PlanContext
+                        ) -> Tuple[Optional[Callable], OverrideFn]:
+    """ ``_select_type`` cached for the duration of a ``plan`` call """
+    key = (types, overrides)
+    try:
+        return context.selections[key]
+    except KeyError:
+        pass
+    except TypeError:  # not hashable, so not cacheable
+        return _select_type(types, context.is_selectable, overrides,
+                            context.recursive_overrides)
+    result = context.selections[key] = _select_type(
+        types, context.is_selectable, overrides, context.recursive_overrides)
+    return result
 
 
 def _select_type(types,
-                 is_injectable: Callable[[Callable], bool],
-                 externally_provided: Callable[[Callable], bool],
+                 is_selectable: Callable[[Callable], bool],
                  overrides: Callable[[Callable], Optional[Callable]],
                  recursive_overrides: bool,
-                 custom_builder_fn: Callable[[Callable], Optional[Callable]] = lambda _: None,
                  ) -> Tuple[Optional[Callable], OverrideFn]:
     """
     Choose the first type that can be provided. None otherwise. Also return
@@ -440,20 +588,54 @@ def _select_type(types,
     for candidate in types:
         candidate, new_overrides = _may_override(
             candidate, overrides, recursive_overrides)
-        candidate_stripped = strip_annotated(candidate)
-        if (
-                is_injectable(candidate_stripped)
-                or externally_provided(candidate_stripped)
-                or custom_builder_fn(candidate_stripped) is not None
-        ):
+        if is_selectable(strip_annotated(candidate)):
             return candidate, new_overrides
     return None, overrides
 
 
+def _selectable_func(is_injectable: Callable[[Callable], bool],
+                     externally_provided: Callable[[Callable], bool],
+                     custom_builder_fn: Callable[[Callable], Optional[Callable]],
+                     ) -> Callable[[Callable], bool]:
+    """
+    Return a predicate that says if a type can be provided: it is
+    injectable, externally provided or built by a custom builder.
+    Results are cached, so the given functions are invoked only once
+    per type.
+    """
+    cache = {}  # type: Dict[Callable, bool]
+
+    def is_selectable(class_or_func: Callable) -> bool:
+        try:
+            return cache[class_or_func]
+        except KeyError:
+            pass
+        except TypeError:  # not hashable, so not cacheable
+            return _is_selectable(class_or_func)
+        result = cache[class_or_func] = _is_selectable(class_or_func)
+        return result
+
+    has_custom_builder = custom_builder_fn is not _empty_custom_builder
+
+    def _is_selectable(class_or_func: Callable) -> bool:
+        return bool(
+            is_injectable(class_or_func)
+            or externally_provided(class_or_func)
+            or (has_custom_builder
+                and custom_builder_fn(class_or_func) is not None)
+        )
+
+    return is_selectable
+
+
 def _empty_overrides(class_or_func: Callable) -> Optional[Callable]:
     return None
 
 
+def _empty_custom_builder(class_or_func: Callable) -> Optional[Callable]:
+    return None
+
+
 def _may_override(class_or_func, overrides: OverrideFn, recursive_overrides: bool
                   ) -> Tuple[Callable, OverrideFn]:
     """
@@ -461,6 +643,8 @@ def _may_override(class_or_func, overrides: OverrideFn, recursive_overrides: boo
     In such a case, ``overrides`` function is replaced with ``_empty_overrides``
     to stop overriding in children if recursive_overrides is disabled.
     """
+    if overrides is _empty_overrides:
+        return class_or_func, overrides
     override = overrides(class_or_func)
     under_override = bool(override and override != class_or_func)
     class_or_func = override or class_or_func
@@ -469,10 +653,39 @@ def _may_override(class_or_func, overrides: OverrideFn, recursive_overrides: boo
     return class_or_func, overrides_for_children
 
 
+def _never(class_or_func: Callable) -> bool:
+    return False
+
+
 def _ensure_can_provide_func(cont_or_call: Optional[ContainerOrCallableType]
                              ) -> Callable[[Callable], bool]:
     if cont_or_call is None:
-        return lambda x: False
+        return _never
+    if isinstance(cont_or_call, (frozenset, set, dict)):
+        # the most common case, no need for the slower ABC check below
+        return cont_or_call.__contains__
+    if type(cont_or_call) is list or type(cont_or_call) is tuple:
+        # membership checks are linear on sequences. Subclasses are
+        # left alone, as they might override __contains__
+        try:
+            items = frozenset(cont_or_call)
+        except TypeError:
+            pass  # unhashable items, keep the original container
+        else:
+            return _frozen_contains(items, cont_or_call)
     if isinstance(cont_or_call, Container):
         return cont_or_call.__contains__
     return cont_or_call
+
+
+def _frozen_contains(items: frozenset, sequence: Container
+                     ) -> Callable[[Callable], bool]:
+    """ Membership predicate for ``sequence``, checked on its frozenset
+    ``items``. Unhashable candidates are looked up in the sequence, as
+    the frozenset can't tell about them. """
+    def contains(class_or_func: Callable) -> bool:
+        try:
+            return class_or_func in items
+        except TypeError:
+            return class_or_func in sequence
+    return contains
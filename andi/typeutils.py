@@ -2,11 +2,17 @@ import sys
 import inspect
 import types
 import functools
-from typing import Annotated, Union, List, Callable, Dict, Container, cast, Type, get_args, get_origin, get_type_hints
+from typing import Annotated, Union, List, Callable, Dict, Container, get_args, get_origin, get_type_hints
+
+
+# ``X | Y`` unions (PEP 604) are not typing.Union instances
+_UNION_TYPES = ((Union, types.UnionType) if sys.version_info >= (3, 10)
+                else (Union,))
 
 
 def is_union(tp) -> bool:
-    """ Return True if a passed type is a typing.Union.
+    """ Return True if a passed type is a typing.Union
+    or a ``X | Y`` union.
 
     >>> is_union(Union[int, str])
     True
@@ -17,7 +23,7 @@ def is_union(tp) -> bool:
     >>> is_union(List[str])
     False
     """
-    return hasattr(tp, "__origin__") and tp.__origin__ is Union
+    return get_origin(tp) in _UNION_TYPES
 
 
 def get_type_hints_with_extras(obj, *args, **kwargs):
@@ -44,6 +50,8 @@ def issubclass_safe(cls, bases) -> bool:
     >>> issubclass_safe(123, BaseException)
     False
     """
+    if not isinstance(cls, type):
+        return False
     try:
         return issubclass(cls, bases)
     except TypeError:
@@ -61,6 +69,13 @@ def get_unannotated_params(func, annotations: Container) -> List[str]:
     >>> get_unannotated_params(foo, annotations)
     ['x', 'z']
     """
+    if _has_plain_signature(func):
+        # Fast path: parameter names are read from the code object,
+        # which is much cheaper than building a Signature.
+        # *args and **kwargs names come after these ones.
+        code = func.__code__
+        names = code.co_varnames[:code.co_argcount + code.co_kwonlyargcount]
+        return [name for name in names if name not in annotations]
     ARGS_KWARGS = {
         inspect.Parameter.VAR_POSITIONAL,  # *args argument
         inspect.Parameter.VAR_KEYWORD      # **kwargs argument
@@ -73,15 +88,32 @@ def get_unannotated_params(func, annotations: Container) -> List[str]:
     return res
 
 
+def _has_plain_signature(func) -> bool:
+    """ Return True if ``inspect.signature`` for ``func`` would be
+    based just on its code object. """
+    return (type(func) is types.FunctionType
+            and not hasattr(func, '__wrapped__')
+            and not hasattr(func, '__signature__'))
+
+
 def get_globalns(func: Callable) -> Dict:
     """ Return the global namespace that will be used for the resolution
     of postponed type annotations.
 
     Based on ``typing.get_type_hints`` code, with a workaround for ``attrs``
     issue.
+
+    The returned dict must not be modified: when both namespaces are
+    the same (the common case), the module namespace itself is returned.
     """
-    ns = dict(_get_globalns_for_attrs(func))
-    ns.update(_get_globalns_as_get_type_hints(func))
+    attrs_ns = _get_globalns_for_attrs(func)
+    globalns = _get_globalns_as_get_type_hints(func)
+    if not attrs_ns or attrs_ns is globalns:
+        return globalns
+    if not globalns:
+        return attrs_ns
+    ns = dict(attrs_ns)
+    ns.update(globalns)
     return ns
 
 
@@ -98,11 +130,12 @@ def _get_globalns_as_get_type_hints(func: Callable) -> Dict:
 
 def _get_globalns_for_attrs(func: Callable) -> Dict:
     """ Adds partial support for postponed type annotations in attrs classes.
+    Note that the module namespace itself is returned, not a copy.
     Also required to support attrs classes when
     ``from __future__ import annotations`` is used (default for python 4.0).
     See https://github.com/python-attrs/attrs/issues/593 """
     if getattr(func, '__module__', None) in sys.modules:
-        return dict(sys.modules[func.__module__].__dict__)
+        return sys.modules[func.__module__].__dict__
     else:
         # Theoretically this can happen if someone writes
         # a custom string to func.__module__.  In which case
@@ -129,12 +162,12 @@ def get_callable_func_obj(class_or_func: Callable) -> Callable:
     when func(...) is called. The resulting object should be
     supported by ``get_type_hints``.
     """
+    if type(class_or_func) is types.FunctionType:
+        return class_or_func  # the most common case
     if not callable(class_or_func):
         raise TypeError("%r is not callable" % (class_or_func,))
-    is_class = isinstance(class_or_func, type)
-    if is_class:
-        cls = cast(Type, class_or_func)
-        return cls.__init__
+    if isinstance(class_or_func, type):
+        return class_or_func.__init__  # type: ignore[misc]
     else:
         # we need to check some exact types, because some function-like
         # object also have __call__ method, while it is better
@@ -1,5 +1,6 @@
 import pytest
 
+from andi import NonProvidableError
 from andi.errors import CyclicDependencyErrCase, NonInjectableOrExternalErrCase, \
     LackingAnnotationErrCase, _class_or_func_str, _cyclic_dependency_error, \
     _argument_lacking_annotation_error, _no_injectable_or_external_error, \
@@ -27,4 +28,11 @@ def test_class_or_func_str():
     assert _class_or_func_str(E) == "<class 'tests.test_plan.E'>.__init__()"
     fn_str = _class_or_func_str(test_class_or_func_str)
     assert fn_str.startswith("<function test_class_or_func_str")
-    assert fn_str.endswith(">")
\ No newline at end of file
+    assert fn_str.endswith(">")
+
+
+def test_non_providable_error_message():
+    errors = {'a': [LackingAnnotationErrCase('a', E)]}
+    err = NonProvidableError(E, errors)
+    assert str(err) == _exception_msg(E, errors)
+    assert err.args == (str(err),)
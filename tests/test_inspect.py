@@ -1,3 +1,6 @@
+import gc
+import sys
+import weakref
 from functools import wraps, partial
 from typing import Union, Optional, TypeVar, Type, Annotated
 
@@ -28,6 +31,7 @@ def test_andi():
     def func3(x: Bar, y: Foo):
         pass
 
+    assert andi.inspect(Foo) == {}
     assert andi.inspect(Foo.__init__) == {}
     assert andi.inspect(func1) == {'x': [Foo]}
     assert andi.inspect(func2) == {}
@@ -41,6 +45,15 @@ def test_union():
     assert andi.inspect(func) == {'x': [Foo, Bar]}
 
 
+@pytest.mark.skipif(sys.version_info < (3, 10),
+                    reason="X | Y unions require Python 3.10+")
+def test_pep604_union():
+    def func(x: Foo | Bar, y: Baz | None):
+        pass
+
+    assert andi.inspect(func) == {'x': [Foo, Bar], 'y': [Baz, type(None)]}
+
+
 def test_optional():
     def func(x: Optional[Foo]):
         pass
@@ -140,3 +153,43 @@ def test_annotations():
         pass
 
     assert andi.inspect(f) == {"x": [Annotated[int, 42]]}
+
+
+def test_result_is_not_shared():
+    def func(x: Union[Foo, Bar], y: Baz):
+        pass
+
+    res = andi.inspect(func)
+    res['x'].append(Baz)
+    del res['y']
+    assert andi.inspect(func) == {'x': [Foo, Bar], 'y': [Baz]}
+
+
+def test_bound_methods():
+    class MyClass:
+        def meth(self, x: Foo):
+            pass
+
+    assert andi.inspect(MyClass().meth) == {'x': [Foo]}
+    assert andi.inspect(MyClass().meth) == {'x': [Foo]}
+
+
+def test_inspect_doesnt_keep_classes_alive():
+    namespace = {}
+    exec(
+        "class A:\n"
+        "    def __init__(self, b: 'B'): pass\n"
+        "class B:\n"
+        "    def __init__(self, c: 'C'): pass\n"
+        "class C:\n"
+        "    def __init__(self, a: 'A'): pass\n",
+        namespace,
+    )
+    refs = []
+    for name in 'ABC':
+        cls = namespace[name]
+        andi.inspect(cls)
+        refs.append(weakref.ref(cls))
+    del cls, namespace
+    gc.collect()
+    assert [ref() for ref in refs] == [None, None, None]
@@ -1,5 +1,7 @@
+import sys
 from functools import partial
-from typing import Union, Optional, Dict, Callable, Annotated
+from operator import itemgetter
+from typing import Union, Optional, Dict, Callable, Annotated, Literal
 
 import pytest
 
@@ -9,7 +11,6 @@ from andi.andi import CustomBuilder
 from andi.errors import CyclicDependencyErrCase, \
     NonInjectableOrExternalErrCase, LackingAnnotationErrCase
 from tests.utils import build
-from collections import OrderedDict
 
 
 class A:
@@ -44,14 +45,10 @@ ALL = [A, B, C, D, E]
 SOME = [A, B, C]
 
 
-def _final_kwargs_spec(plan):
-    return plan[-1][1]
-
-
 def error_causes(exec_info):
     """ Return the error causes in a deterministic order """
     errors = sorted(exec_info.value.errors_per_argument.items(),
-                    key=lambda t: t[0])
+                    key=itemgetter(0))
     for _, errs in errors:
         errs.sort(key=str)
     return errors
@@ -72,6 +69,71 @@ def test_plan_and_build():
     assert type(instances[E]) == E
 
 
+def test_plan_shared_dependencies_planned_once(monkeypatch):
+    inspected = []
+    orig_inspect = andi.andi._inspect
+
+    def _inspect(class_or_func):
+        inspected.append(class_or_func)
+        return orig_inspect(class_or_func)
+
+    monkeypatch.setattr(andi.andi, "_inspect", _inspect)
+    plan = andi.plan(E, is_injectable=ALL, externally_provided={A})
+    assert plan == [
+        (A, {}),
+        (B, {}),
+        (C, {'a': A, 'b': B}),
+        (D, {'a': A, 'c': C}),
+        (E, {'b': B, 'c': C, 'd': D})
+    ]
+    assert sorted(inspected, key=lambda cls: cls.__name__) == [B, C, D, E]
+
+
+def test_selectable_func_cached():
+    calls = []
+
+    def is_injectable(cls):
+        calls.append(cls)
+        return cls in SOME
+
+    is_selectable = andi.andi._selectable_func(
+        is_injectable, {E}.__contains__, lambda _: None)
+    for _ in range(2):
+        assert is_selectable(A)
+        assert not is_selectable(D)
+        assert is_selectable(E)
+        assert not is_selectable(list[int])
+    assert calls == [A, D, E, list[int]]
+
+
+def test_select_type_cached():
+    calls = []
+
+    def overrides(cls):
+        calls.append(cls)
+        return None
+
+    plan = andi.plan(E, is_injectable=ALL, externally_provided={A},
+                     overrides=overrides, recursive_overrides=True)
+    assert [cls for cls, _ in plan] == [A, B, C, D, E]
+    assert sorted(calls, key=lambda cls: cls.__name__) == [A, B, C, D, E]
+
+
+def test_plan_deep_dependency_chain():
+    classes = [B]
+    for i in range(sys.getrecursionlimit() + 100):
+        def __init__(self, dep):
+            pass
+        __init__.__annotations__ = {'dep': classes[-1]}
+        classes.append(type(f'Chain{i}', (), {'__init__': __init__}))
+
+    plan = andi.plan(classes[-1], is_injectable=set(classes))
+    assert [cls for cls, _ in plan] == classes
+    assert plan.full_final_kwargs
+    instances = build(plan)
+    assert type(instances[classes[-1]]) == classes[-1]
+
+
 def test_cyclic_dependency():
     plan = andi.plan(E, is_injectable=lambda x: True,
                      externally_provided={A})  # No error if externally provided
@@ -92,15 +154,17 @@ def test_cyclic_dependency():
     assert error_causes(exec_info) == expected_errors
 
 
+def _with_inits(classes):
+    """ Classes along with their ``__init__`` methods """
+    return classes + [cl.__init__ for cl in classes]
+
+
 @pytest.mark.parametrize("cls,is_injectable,externally_provided", [
-    (E, ALL, SOME),
-    (C, SOME, ALL),
-    (E, ALL, ALL),
+    (E, _with_inits(ALL), _with_inits(SOME)),
+    (C, _with_inits(SOME), _with_inits(ALL)),
+    (E, _with_inits(ALL), _with_inits(ALL)),
 ])
 def test_plan_similar_for_class_or_func(cls, is_injectable, externally_provided):
-    is_injectable = is_injectable + [cl.__init__ for cl in is_injectable]
-    externally_provided = externally_provided + [cl.__init__
-                                                 for cl in externally_provided]
     external_deps = {cl: "external" for cl in externally_provided}
 
     plan_cls = andi.plan(cls, is_injectable=is_injectable,
@@ -164,7 +228,7 @@ def test_plan_with_optionals():
 
     plan = andi.plan(fn, is_injectable={type(None)})
     assert plan.dependencies == [(type(None), {})]
-    assert _final_kwargs_spec(plan) == {'a': type(None)}
+    assert plan[-1][1] == {'a': type(None)}
     assert plan.full_final_kwargs
 
     instances = build(plan)
@@ -267,18 +331,18 @@ def test_externally_provided():
     plan = andi.plan(E.__init__, is_injectable=ALL,
                      externally_provided=ALL)
     assert dict(plan.dependencies) == {B: {}, C: {}, D: {}}
-    assert _final_kwargs_spec(plan) == {'b': B, 'c': C, 'd': D}
+    assert plan[-1][1] == {'b': B, 'c': C, 'd': D}
     assert plan.full_final_kwargs
 
     plan = andi.plan(E.__init__, is_injectable=[],
                      externally_provided=ALL)
     assert dict(plan.dependencies) == {B: {}, C: {}, D: {}}
-    assert _final_kwargs_spec(plan) == {'b': B, 'c': C, 'd': D}
+    assert plan[-1][1] == {'b': B, 'c': C, 'd': D}
     assert plan.full_final_kwargs
 
     plan = andi.plan(E, is_injectable=ALL, externally_provided=ALL)
     assert plan == [(E, {})]
-    assert _final_kwargs_spec(plan) == {}
+    assert plan[-1][1] == {}
     assert plan.dependencies == []
     assert plan.full_final_kwargs
 
@@ -286,18 +350,17 @@ def test_externally_provided():
                      externally_provided={A, B, C, D})
     assert dict(plan).keys() == {B, C, D, E}
     assert plan[-1][0] == E
-    assert _final_kwargs_spec(plan) == {'b': B, 'c': C, 'd': D}
-    assert _final_kwargs_spec(plan) == plan[-1][1]
+    assert plan[-1][1] == {'b': B, 'c': C, 'd': D}
     assert plan.full_final_kwargs
 
     plan = andi.plan(E, is_injectable=ALL,
                      externally_provided={A, B, D})
-    plan_od = OrderedDict(plan)
-    seq = list(plan_od.keys())
-    assert seq.index(A) < seq.index(C)
-    assert seq.index(B) < seq.index(C)
-    assert seq.index(D) < seq.index(E)
-    assert seq.index(C) < seq.index(E)
+    plan_od = dict(plan)
+    rank = {cls: idx for idx, cls in enumerate(plan_od)}
+    assert rank[A] < rank[C]
+    assert rank[B] < rank[C]
+    assert rank[D] < rank[E]
+    assert rank[C] < rank[E]
     for cls in (A, B, D):
         assert plan_od[cls] == {}
     assert plan_od[C] == {'a': A, 'b': B}
@@ -313,7 +376,7 @@ def test_plan_for_func():
 
     plan = andi.plan(fn, is_injectable=ALL,
                      externally_provided={A})
-    assert _final_kwargs_spec(plan) == {'e': E, 'c': C}
+    assert plan[-1][1] == {'e': E, 'c': C}
     assert not plan.full_final_kwargs
     instances = build(plan.dependencies, {A: ""})
     fn(other="yeah!", **plan.final_kwargs(instances))
@@ -342,14 +405,14 @@ def test_plan_non_annotated_args():
     )
 
     assert dict(plan.dependencies) == {A: {}, B: {}}
-    assert _final_kwargs_spec(plan) == {'a': A, 'b': B}
+    assert plan[-1][1] == {'a': A, 'b': B}
     assert not plan.full_final_kwargs
 
     plan_class = andi.plan(WithNonAnnArgs,
                            is_injectable=ALL,
                            externally_provided=[A])
     assert plan_class.dependencies == plan.dependencies
-    assert _final_kwargs_spec(plan_class) == _final_kwargs_spec(plan)
+    assert plan_class[-1][1] == plan[-1][1]
     assert not plan.full_final_kwargs
 
     with pytest.raises(TypeError):
@@ -374,7 +437,7 @@ def test_plan_non_annotated_args():
     ]
 
 
-@pytest.mark.parametrize("full_final_kwargs", [[True], [False]])
+@pytest.mark.parametrize("full_final_kwargs", [True, False])
 def test_plan_no_args(full_final_kwargs):
     def fn():
         return True
@@ -387,7 +450,7 @@ def test_plan_no_args(full_final_kwargs):
     assert fn(**plan.final_kwargs(instances))
 
 
-@pytest.mark.parametrize("full_final_kwargs", [[True], [False]])
+@pytest.mark.parametrize("full_final_kwargs", [True, False])
 def test_plan_use_fn_as_annotations(full_final_kwargs):
     def fn_ann(b: B):
         setattr(b, "modified", True)
@@ -420,6 +483,8 @@ def test_plan_overrides(recursive_overrides):
     assert plan == [(B, {})]
     plan = plan_fn(C, is_injectable=ALL, overrides={A: B}.get)
     assert plan == [(B, {}), (C, {'a': B, 'b': B})]
+    plan = plan_fn(C, is_injectable=ALL, overrides={A: B})
+    assert plan == [(B, {}), (C, {'a': B, 'b': B})]
     plan = plan_fn(C, is_injectable=ALL, externally_provided=[A],
                    overrides={A: B, B: A}.get)
     assert (plan == [(B, {}), (A, {}), (C, {'a': B, 'b': A})] or
@@ -600,3 +665,50 @@ def test_plan_custom_builder_not_externally_provided():
     assert error_causes(exc_info) == [
         ("item", [NonInjectableOrExternalErrCase("item", Page, [Item])])
     ]
+
+
+def test_plan_custom_builder_requires_built_type():
+    # The custom builder requires the very type it builds
+
+    class Engine:
+        pass
+
+    class Car:
+        def __init__(self, engine: Engine):
+            pass
+
+    def build_engine(engine: Engine) -> Engine:
+        return engine
+
+    with pytest.raises(andi.NonProvidableError) as exc_info:
+        andi.plan(
+            Car,
+            is_injectable={Engine, Car},
+            custom_builder_fn={Engine: build_engine}.get
+        )
+    builder = CustomBuilder(Engine, build_engine)
+    assert error_causes(exc_info) == [
+        ("engine", [CyclicDependencyErrCase(build_engine, [Car, builder])])
+    ]
+
+
+def test_plan_unhashable_annotation():
+    def fn(b: B, x: Literal[[1]]):
+        pass
+
+    plan = andi.plan(fn, is_injectable=[B])
+    assert plan == [(B, {}), (fn, {'b': B})]
+    assert not plan.full_final_kwargs
+
+
+def test_plan_list_subclass_container():
+    class Everything(list):
+        def __contains__(self, item):
+            return True
+
+    class WithB:
+        def __init__(self, b: B):
+            pass
+
+    plan = andi.plan(WithB, is_injectable=Everything())
+    assert plan == [(B, {}), (WithB, {'b': B})]
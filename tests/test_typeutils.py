@@ -1,14 +1,30 @@
+import sys
 from typing import Union, Optional, get_type_hints, Annotated
 
 import pytest
 
-from andi.typeutils import get_union_args, get_callable_func_obj, get_type_hints_with_extras
+from andi.typeutils import (
+    get_union_args,
+    get_callable_func_obj,
+    get_type_hints_with_extras,
+    get_unannotated_params,
+    get_globalns,
+    is_union,
+)
 
 
 def test_get_union_args():
     assert get_union_args(Union[str, int]) == [str, int]
 
 
+@pytest.mark.skipif(sys.version_info < (3, 10),
+                    reason="X | Y unions require Python 3.10+")
+def test_pep604_union():
+    assert is_union(int | str)
+    assert is_union(int | None)
+    assert get_union_args(int | str) == [int, str]
+
+
 def test_get_union_args_optional():
     assert get_union_args(Optional[Union[str, int]]) == [str, int, None.__class__]
 
@@ -90,3 +106,28 @@ def test_get_hint_extras():
 
     hints_annotated = get_type_hints_with_extras(f)
     assert hints_annotated["x"] == Annotated[int, 42]
+
+
+def test_get_unannotated_params():
+    def foo(a, b: int, /, c, d: str = "", *args, e, f: int, g=1, **kwargs):
+        pass
+
+    annotations = get_type_hints(foo)
+    assert get_unannotated_params(foo, annotations) == ['a', 'c', 'e', 'g']
+
+    class Foo:
+        def meth(self, a, b: int):
+            pass
+
+    assert get_unannotated_params(Foo.meth, {'b': int}) == ['self', 'a']
+    assert get_unannotated_params(Foo().meth, {'b': int}) == ['a']
+    assert get_unannotated_params(Foo, {}) == []
+
+
+def test_get_globalns():
+    def foo():
+        pass
+
+    assert get_globalns(foo) is globals()
+    foo.__module__ = 'non_existing_module'
+    assert get_globalns(foo) is globals()
@@ -8,7 +8,8 @@ def build(plan: List[Step],
           instances_stock: Optional[Dict[Callable, Any]] = None,
           ) -> Dict[Callable, Any]:
     """ Build instances dictionary from a plan """
-    instances_stock = instances_stock or {}
+    if instances_stock is None:
+        instances_stock = {}
     instances = {}
     for cls, kwargs_spec in plan:
         if cls in instances_stock: